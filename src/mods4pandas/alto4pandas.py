@@ -5,95 +5,118 @@ import os
 import re
 import warnings
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from xml.dom.expatbuilder import Namespaces
 from lxml import etree as ET
 from itertools import groupby
-from operator import attrgetter
-from typing import List
+from typing import List, Optional
 from collections.abc import MutableMapping, Sequence
 
 import click
-import pandas as pd
-import numpy as np
 from tqdm import tqdm
 
-from .lib import TagGroup, sorted_groupby, flatten, ns
+from .lib import TagGroup, grouped_by_tag, flatten, dicts_to_df, descriptive_statistics, \
+    singleton_text, capture_warnings, pop_caught_warnings, _split_qname
 
 
 logger = logging.getLogger('alto4pandas')
 
 
+# Parser shared by all files parsed in a process. Nothing looks up elements by ID, so there is no need for libxml2 to
+# collect the IDs.
+_parser = ET.XMLParser(collect_ids=False)
+
+
+def _singleton_text(tag_group, raise_errors):
+    return singleton_text(tag_group.tag, tag_group.group)
+
+
+def _singleton_descend(tag_group, raise_errors):
+    return tag_group.is_singleton().descend(raise_errors)
+
+
+def _singleton_no_attributes_descend(tag_group, raise_errors):
+    return tag_group.is_singleton().has_no_attributes().descend(raise_errors)
+
+
+def _page(tag_group, raise_errors):
+    _, alto_namespace = _split_qname(tag_group.tag)
+
+    value = tag_group.is_singleton().attributes()
+    value.update(tag_group.subelement_counts())
+
+    # Statistics on the word confidences and the count of all alto:String elements with TAGREFS attribute.
+    # Collect both in one pass over the alto:String elements instead of evaluating "//alto:String/@WC" and
+    # "//alto:String[@TAGREFS]", which each walk the whole document again.
+    string_tag = f'{{{alto_namespace}}}String'
+    wcs = []
+    tagrefs_count = 0
+    for e in tag_group.group:
+        for string in e.iter(string_tag):
+            wc = string.get('WC')
+            if wc is not None:
+                wcs.append(wc)
+            if string.get('TAGREFS') is not None:
+                tagrefs_count += 1
+    value.update(descriptive_statistics(wcs, "//alto:String/@WC"))
+    value["//alto:String[@TAGREFS]-count"] = tagrefs_count
+    return value
+
+
+def _tags(tag_group, raise_errors):
+    return tag_group.subelement_counts()
+
+
+# Handlers for the ALTO elements, by local name. A handler converts the TagGroup of an element to its value.
+_ALTO_HANDLERS = {
+    'Description': _singleton_no_attributes_descend,
+    'MeasurementUnit': _singleton_text,
+    'OCRProcessing': _singleton_descend,
+    'processingDateTime': _singleton_text,
+    'processingSoftware': _singleton_descend,
+    'processingAgency': _singleton_text,
+    'processingStepDescription': _singleton_text,
+    'processingStepSettings': _singleton_text,
+    'softwareCreator': _singleton_text,
+    'softwareName': _singleton_text,
+    'softwareVersion': _singleton_text,
+
+    'sourceImageInformation': _singleton_no_attributes_descend,
+    'fileName': _singleton_text,
+
+    'Layout': _singleton_no_attributes_descend,
+    'Page': _page,
+
+    'Tags': _tags,
+}
+
+# Elements that may be repeated. These are descended into one by one and enumerated, e.g. Processing0, Processing1.
+_ALTO_ENUMERATED = {'Processing', 'ocrProcessingStep', 'preProcessingStep'}
+
+# Elements that are explicitly ignored
+_ALTO_IGNORED = {'Styles'}
+
 
 def alto_to_dict(alto, raise_errors=True):
     """Convert ALTO metadata to a nested dictionary"""
 
     value = {}
 
-    # Iterate through each group of tags
-    for tag, group in sorted_groupby(alto, key=attrgetter('tag')):
-        group = list(group)
-
-        localname = ET.QName(tag).localname
-        alto_namespace = ET.QName(tag).namespace
-        namespaces={"alto": alto_namespace}
-
-        if localname == 'Description':
-            value[localname] = TagGroup(tag, group).is_singleton().has_no_attributes().descend(raise_errors)
-        elif localname == 'MeasurementUnit':
-            value[localname] = TagGroup(tag, group).is_singleton().has_no_attributes().text()
-        elif localname == 'OCRProcessing':
-            value[localname] = TagGroup(tag, group).is_singleton().descend(raise_errors)
-        elif localname == 'Processing':
-            # TODO This enumerated descent is used more than once, DRY!
-            for n, e in enumerate(group):
-                value[f'{localname}{n}'] = alto_to_dict(e, raise_errors)
-        elif localname == 'ocrProcessingStep':
-            for n, e in enumerate(group):
-                value[f'{localname}{n}'] = alto_to_dict(e, raise_errors)
-        elif localname == 'preProcessingStep':
+    # Iterate through each group of tags. Only the (few) distinct tags are sorted, not the elements themselves.
+    for tag, group in sorted(grouped_by_tag(alto)):
+        localname, _ = _split_qname(tag)
+
+        handler = _ALTO_HANDLERS.get(localname)
+        if handler is not None:
+            value[localname] = handler(TagGroup(tag, group), raise_errors)
+        elif localname in _ALTO_ENUMERATED:
             for n, e in enumerate(group):
                 value[f'{localname}{n}'] = alto_to_dict(e, raise_errors)
-        elif localname == 'processingDateTime':
-            value[localname] = TagGroup(tag, group).is_singleton().has_no_attributes().text()
-        elif localname == 'processingSoftware':
-            value[localname] = TagGroup(tag, group).is_singleton().descend(raise_errors)
-        elif localname == 'processingAgency':
-            value[localname] = TagGroup(tag, group).is_singleton().has_no_attributes().text()
-        elif localname == 'processingStepDescription':
-            value[localname] = TagGroup(tag, group).is_singleton().has_no_attributes().text()
-        elif localname == 'processingStepSettings':
-            value[localname] = TagGroup(tag, group).is_singleton().has_no_attributes().text()
-        elif localname == 'softwareCreator':
-            value[localname] = TagGroup(tag, group).is_singleton().has_no_attributes().text()
-        elif localname == 'softwareName':
-            value[localname] = TagGroup(tag, group).is_singleton().has_no_attributes().text()
-        elif localname == 'softwareVersion':
-            value[localname] = TagGroup(tag, group).is_singleton().has_no_attributes().text()
-
-        elif localname == 'sourceImageInformation':
-            value[localname] = TagGroup(tag, group).is_singleton().has_no_attributes().descend(raise_errors)
-        elif localname == 'fileName':
-            value[localname] = TagGroup(tag, group).is_singleton().has_no_attributes().text()
-
-        elif localname == 'Layout':
-            value[localname] = TagGroup(tag, group).is_singleton().has_no_attributes().descend(raise_errors)
-        elif localname == 'Page':
-            value[localname] = {}
-            value[localname].update(TagGroup(tag, group).is_singleton().attributes())
-            value[localname].update(TagGroup(tag, group).subelement_counts())
-            value[localname].update(TagGroup(tag, group).xpath_statistics("//alto:String/@WC", namespaces))
-
-            # Count all alto:String elements with TAGREFS attribute
-            value[localname].update(TagGroup(tag, group).xpath_count("//alto:String[@TAGREFS]", namespaces))
-
-        elif localname == 'Styles':
+        elif localname in _ALTO_IGNORED:
             pass
-        elif localname == 'Tags':
-            value[localname] = {}
-            value[localname].update(TagGroup(tag, group).subelement_counts())
         else:
             if raise_errors:
-                print(value)
+                logger.debug('Partial value at unknown tag %s: %r', tag, value)
                 raise ValueError('Unknown tag "{}"'.format(tag))
             else:
                 pass
@@ -105,34 +128,64 @@ def alto_to_dict(alto, raise_errors=True):
 def walk(m):
     # XXX do this in mods4pandas, too
     if os.path.isdir(m):
-        tqdm.write(f'Scanning directory {m}')
-        for f in tqdm(os.scandir(m), leave=False):
-            if f.is_file() and not f.name.startswith('.'):
-                yield f.path
-            elif f.is_dir():
-                try:
-                    yield from walk(f.path)
-                except PermissionError:
-                    warnings.warn(f"Error walking {f.path}")
+        def onerror(e):
+            warnings.warn(f"Error walking {e.filename}")
+
+        for dirpath, dirnames, filenames in os.walk(m, onerror=onerror, followlinks=True):
+            tqdm.write(f'Scanning directory {dirpath}')
+            # Skip hidden directories and files
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for f in filenames:
+                if not f.startswith('.'):
+                    yield os.path.join(dirpath, f)
     else:
-        yield m.path
+        yield m
 
 
 
+def _process_one(alto_file):
+    """
+    Convert the given ALTO file to a flat dict.
+
+    Return the dict (or None if the conversion failed) and the messages of the warnings caught while converting.
+    This runs in a worker process (set up with capture_warnings()), so it returns only picklable values.
+    """
+    try:
+        root = ET.parse(alto_file, _parser).getroot()
+        alto = root # XXX .find('alto:alto', ns) does not work here
+
+        # ALTO
+        d = flatten(alto_to_dict(alto, raise_errors=True))
+        # "meta"
+        d['alto_file'] = alto_file
+        _, d['alto_xmlns'] = _split_qname(alto.tag)
+
+        return d, pop_caught_warnings()
+    except Exception as e:
+        logger.error('Exception in {}: {}'.format(alto_file, e))
+        import traceback; traceback.print_exc()
+        pop_caught_warnings()
+        return None, []
+
+
 @click.command()
 @click.argument('alto_files', type=click.Path(exists=True), required=True, nargs=-1)
-@click.option('--output', '-o', 'output_file', type=click.Path(), help='Output pickle file',
-              default='alto_info_df.pkl', show_default=True)
+@click.option('--output', '-o', 'output_file', type=click.Path(), help='Output Parquet file',
+              default='alto_info_df.parquet', show_default=True)
 @click.option('--output-csv', type=click.Path(), help='Output CSV file')
 @click.option('--output-xlsx', type=click.Path(), help='Output Excel .xlsx file')
-def process(alto_files: List[str], output_file: str, output_csv: str, output_xlsx: str):
+@click.option('--workers', type=click.IntRange(min=1), help='Number of worker processes [default: number of CPUs]')
+@click.option('--chunksize', type=click.IntRange(min=1), help='Number of files sent to a worker at once',
+              default=16, show_default=True)
+def process(alto_files: List[str], output_file: str, output_csv: str, output_xlsx: str, workers: Optional[int],
+            chunksize: int):
     """
     A tool to convert the ALTO metadata in INPUT to a pandas DataFrame.
 
     INPUT is assumed to be a ALTO document. INPUT may optionally be a directory. The tool then reads
     all files in the directory.
 
-    alto4pandas writes two output files: A pickled pandas DataFrame and a CSV file with all conversion warnings.
+    alto4pandas writes two output files: A pandas DataFrame (as Parquet) and a CSV file with all conversion warnings.
     """
 
     # Extend file list if directories are given
@@ -141,49 +194,26 @@ def process(alto_files: List[str], output_file: str, output_csv: str, output_xls
         for x in walk(m):
             alto_files_real.append(x)
 
-    # Process ALTO files
-    with open(output_file + '.warnings.csv', 'w') as csvfile:
+    # Process ALTO files, in parallel. The files are independent of each other, so the worker processes only
+    # have to send back the resulting dict and the warnings.
+    with open(output_file + '.warnings.csv', 'w', newline='', buffering=1 << 20) as csvfile, \
+            ProcessPoolExecutor(max_workers=workers, initializer=capture_warnings) as executor:
         csvwriter = csv.writer(csvfile)
         alto_info = []
         logger.info('Processing ALTO files')
-        for alto_file in tqdm(alto_files_real, leave=False):
-            try:
-                root = ET.parse(alto_file).getroot()
-                alto = root # XXX .find('alto:alto', ns) does not work here
-
-                with warnings.catch_warnings(record=True) as caught_warnings:
-                    warnings.simplefilter('always')  # do NOT filter double occurrences
-
-                    # ALTO
-                    d = flatten(alto_to_dict(alto, raise_errors=True))
-                    # "meta"
-                    d['alto_file'] = alto_file
-                    d['alto_xmlns'] = ET.QName(alto).namespace
-
-                    alto_info.append(d)
-
-                    if caught_warnings:
-                        # PyCharm thinks caught_warnings is not Iterable:
-                        # noinspection PyTypeChecker
-                        for caught_warning in caught_warnings:
-                            csvwriter.writerow([alto_file, caught_warning.message])
-            except Exception as e:
-                logger.error('Exception in {}: {}'.format(alto_file, e))
-                import traceback; traceback.print_exc()
+        results = executor.map(_process_one, alto_files_real, chunksize=chunksize)
+        for alto_file, (d, caught_warnings) in tqdm(zip(alto_files_real, results), total=len(alto_files_real),
+                                                    leave=False):
+            if d is not None:
+                alto_info.append(d)
+            csvwriter.writerows([alto_file, caught_warning] for caught_warning in caught_warnings)
 
     # Convert the alto_info List[Dict] to a pandas DataFrame
-    columns = []
-    for m in alto_info:
-        for c in m.keys():
-            if c not in columns:
-                columns.append(c)
-    data = [[m.get(c) for c in columns] for m in alto_info]
-    index = [m['alto_file'] for m in alto_info] # TODO use ppn + page?
-    alto_info_df = pd.DataFrame(data=data, index=index, columns=columns)
-
-    # Pickle the DataFrame
+    alto_info_df = dicts_to_df(alto_info, index_column="alto_file")  # TODO use ppn + page?
+
+    # Save the DataFrame
     logger.info('Writing DataFrame to {}'.format(output_file))
-    alto_info_df.to_pickle(output_file)
+    alto_info_df.to_parquet(output_file)
     if output_csv:
         logger.info('Writing CSV to {}'.format(output_csv))
         alto_info_df.to_csv(output_csv)
@@ -195,9 +225,6 @@ def process(alto_files: List[str], output_file: str, output_csv: str, output_xls
 def main():
     logging.basicConfig(level=logging.INFO)
 
-    for prefix, uri in ns.items():
-        ET.register_namespace(prefix, uri)
-
     process()
 
 
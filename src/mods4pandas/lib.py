@@ -1,12 +1,17 @@
+from collections import Counter
+from functools import lru_cache
 from itertools import groupby
 import re
+import sys
 import warnings
-from typing import List, Sequence, MutableMapping, Dict
+from typing import List, Sequence, Dict, Tuple, FrozenSet, TYPE_CHECKING
 
-import pandas as pd
 import numpy as np
 from lxml import etree as ET
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 
 __all__ = ["ns"]
 
@@ -18,10 +23,35 @@ ns = {
     "xlink": "http://www.w3.org/1999/xlink",
 }
 
+@lru_cache(maxsize=1024)
+def _split_qname(tag) -> Tuple[str, str]:
+    """
+    Split the given tag (or attribute name) into its local name and namespace.
+
+    The tags come from a small vocabulary, so we cache the result instead of building a QName every time. The local
+    names are interned, as they end up as (parts of) dict keys.
+    """
+    qname = ET.QName(tag)
+    return sys.intern(qname.localname), qname.namespace
+
+
+# Tags of the originInfo children looked at by TagGroup.fix_event_type()
+_MODS_PUBLISHER = f"{{{ns['mods']}}}publisher"
+_MODS_EDITION = f"{{{ns['mods']}}}edition"
+_MODS_DATE_ISSUED = f"{{{ns['mods']}}}dateIssued"
+_MODS_DATE_CREATED = f"{{{ns['mods']}}}dateCreated"
+_FIX_EVENT_TYPE_TAGS = frozenset({_MODS_PUBLISHER, _MODS_EDITION, _MODS_DATE_ISSUED, _MODS_DATE_CREATED})
 
 
 class TagGroup:
-    """Helper class to simplify the parsing and checking of MODS metadata"""
+    """
+    Helper class to simplify the parsing and checking of MODS metadata
+
+    Methods that filter or sort the group (filter(), force_singleton(), sort(), ...) change it in place and return
+    self, so they can be chained.
+    """
+
+    __slots__ = ('tag', 'group')
 
     def __init__(self, tag, group: List[ET.Element]):
         self.tag = tag
@@ -44,7 +74,10 @@ class TagGroup:
     def has_attributes(self, attrib):
         if not isinstance(attrib, Sequence):
             attrib = [attrib]
-        if not all(e.attrib in attrib for e in self.group):
+        # Compare the attributes as hashable sets of items, instead of comparing each element's attributes to every
+        # allowed dict in turn
+        allowed = {frozenset(a.items()) for a in attrib}
+        if not all(frozenset(e.items()) in allowed for e in self.group):
             raise ValueError('One or more element has unexpected attributes: {}'.format(self))
         return self
 
@@ -79,7 +112,8 @@ class TagGroup:
             else:
                 if warn:
                     warnings.warn('Filtered {} element ({})'.format(self.tag, warn))
-        return TagGroup(self.tag, new_group)
+        self.group = new_group
+        return self
 
     def force_singleton(self, warn=True):
         if len(self.group) == 1:
@@ -87,32 +121,34 @@ class TagGroup:
         else:
             if warn:
                 warnings.warn('Forced single instance of {}'.format(self.tag))
-            return TagGroup(self.tag, self.group[:1])
+            self.group = self.group[:1]
+            return self
 
-    RE_ISO8601_DATE = r'^\d{2}(\d{2}|XX)(-\d{2}-\d{2})?$'  # Note: Includes non-specific century dates like '18XX'
-    RE_GERMAN_DATE = r'^(?P<dd>\d{2})\.(?P<mm>\d{2})\.(?P<yyyy>\d{4})$'
+    # Note: Includes non-specific century dates like '18XX'
+    RE_ISO8601_DATE = re.compile(r'^\d{2}(\d{2}|XX)(-\d{2}-\d{2})?$')
+    RE_GERMAN_DATE = re.compile(r'^(?P<dd>\d{2})\.(?P<mm>\d{2})\.(?P<yyyy>\d{4})$')
 
     def fix_date(self):
 
         for e in self.group:
-            if e.attrib.get('encoding') == 'w3cdtf':
+            if e.get('encoding') == 'w3cdtf':
                 # This should be 'iso8601' according to MODS-AP 2.3.1
                 warnings.warn('Changed w3cdtf encoding to iso8601')
-                e.attrib['encoding'] = 'iso8601'
+                e.set('encoding', 'iso8601')
 
         new_group = []
         for e in self.group:
-            if e.attrib.get('encoding') == 'iso8601' and re.match(self.RE_ISO8601_DATE, e.text):
+            iso8601_match = self.RE_ISO8601_DATE.match(e.text)
+            if e.get('encoding') == 'iso8601' and iso8601_match:
                 new_group.append(e)
-            elif re.match(self.RE_ISO8601_DATE, e.text):
+            elif iso8601_match:
                 warnings.warn('Added iso8601 encoding to date {}'.format(e.text))
-                e.attrib['encoding'] = 'iso8601'
+                e.set('encoding', 'iso8601')
                 new_group.append(e)
-            elif re.match(self.RE_GERMAN_DATE, e.text):
+            elif m := self.RE_GERMAN_DATE.match(e.text):
                 warnings.warn('Converted date {} to iso8601 encoding'.format(e.text))
-                m = re.match(self.RE_GERMAN_DATE, e.text)
                 e.text = '{}-{}-{}'.format(m.group('yyyy'), m.group('mm'), m.group('dd'))
-                e.attrib['encoding'] = 'iso8601'
+                e.set('encoding', 'iso8601')
                 new_group.append(e)
             else:
                 warnings.warn('Not a iso8601 date: "{}"'.format(e.text))
@@ -135,36 +171,35 @@ class TagGroup:
         # Fix this for special cases.
 
         for e in self.group:
-            if e.attrib.get('eventType') is None:
-                try:
-                    if e.find('mods:publisher', ns).text.startswith('Staatsbibliothek zu Berlin') and \
-                            e.find('mods:edition', ns).text == '[Electronic ed.]':
-                        e.attrib['eventType'] = 'digitization'
-                        warnings.warn('Fixed eventType for electronic ed.')
-                        continue
-                except AttributeError:
-                    pass
-                try:
-                    if e.find('mods:dateIssued', ns) is not None:
-                        e.attrib['eventType'] = 'publication'
-                        warnings.warn('Fixed eventType for an issued origin')
-                        continue
-                except AttributeError:
-                    pass
-                try:
-                    if e.find('mods:dateCreated', ns) is not None:
-                        e.attrib['eventType'] = 'production'
-                        warnings.warn('Fixed eventType for a created origin')
-                        continue
-                except AttributeError:
-                    pass
+            if e.get('eventType') is None:
+                # Find the first child of each relevant tag in a single pass over the children
+                children = {}
+                for c in e:
+                    if c.tag in _FIX_EVENT_TYPE_TAGS:
+                        children.setdefault(c.tag, c)
+
+                publisher = children.get(_MODS_PUBLISHER)
+                edition = children.get(_MODS_EDITION)
+                if publisher is not None and (publisher.text or '').startswith('Staatsbibliothek zu Berlin') and \
+                        edition is not None and edition.text == '[Electronic ed.]':
+                    e.set('eventType', 'digitization')
+                    warnings.warn('Fixed eventType for electronic ed.')
+                    continue
+                if _MODS_DATE_ISSUED in children:
+                    e.set('eventType', 'publication')
+                    warnings.warn('Fixed eventType for an issued origin')
+                    continue
+                if _MODS_DATE_CREATED in children:
+                    e.set('eventType', 'production')
+                    warnings.warn('Fixed eventType for a created origin')
+                    continue
         return self
 
     def fix_script_term(self):
         for e in self.group:
             # MODS-AP 2.3.1 is not clear about this, but it looks like that this should be lower case.
             if e.attrib['authority'] == 'ISO15924':
-                e.attrib['authority'] = 'iso15924'
+                e.set('authority', 'iso15924')
                 warnings.warn('Changed scriptTerm authority to lower case')
         return self
 
@@ -172,12 +207,9 @@ class TagGroup:
         from .mods4pandas import mods_to_dict
         value = {}
 
-        sub_dicts = [mods_to_dict(e) for e in self.group]
-        sub_tags = {k for d in sub_dicts for k in d.keys()}
-        for sub_tag in sub_tags:
-            s = set()
-            for d in sub_dicts:
-                v = d.get(sub_tag)
+        for e in self.group:
+            for sub_tag, v in mods_to_dict(e).items():
+                s = value.setdefault(sub_tag, set())
                 if v:
                     # There could be multiple scriptTerms in one language element, e.g. Antiqua and Fraktur in a
                     # German language document.
@@ -185,7 +217,6 @@ class TagGroup:
                         s.update(v)
                     else:
                         s.add(v)
-            value[sub_tag] = s
         return value
 
     def attributes(self):
@@ -198,18 +229,22 @@ class TagGroup:
         """
         attrib = {}
         for e in self.group:
-            for a, v in e.attrib.items():
-                a_localname = ET.QName(a).localname
-                attrib[a_localname] = v
+            for a, v in e.items():
+                # Most attributes have no namespace, their name already is the local name
+                if a[0] == '{':
+                    a, _ = _split_qname(a)
+                attrib[a] = v
         return attrib
 
     def subelement_counts(self):
+        # Count the tags as they are, and only convert the (few) distinct tags to local names
+        tag_counts = Counter(x.tag for e in self.group for x in e.iter())
+
         counts = {}
-        for e in self.group:
-            for x in e.iter():
-                tag = ET.QName(x.tag).localname
-                key = f"{tag}-count"
-                counts[key] = counts.get(key, 0) + 1
+        for tag, n in tag_counts.items():
+            localname, _ = _split_qname(tag)
+            key = f"{localname}-count"
+            counts[key] = counts.get(key, 0) + n
         return counts
 
     def xpath_statistics(self, xpath_expr, namespaces):
@@ -221,18 +256,8 @@ class TagGroup:
         """
         values = []
         for e in self.group:
-            r = e.xpath(xpath_expr, namespaces=namespaces)
-            values += r
-        values = np.array([float(v) for v in values])
-
-        statistics = {}
-        if values.size > 0:
-            statistics[f'{xpath_expr}-mean'] = np.mean(values)
-            statistics[f'{xpath_expr}-median'] = np.median(values)
-            statistics[f'{xpath_expr}-std'] = np.std(values)
-            statistics[f'{xpath_expr}-min'] = np.min(values)
-            statistics[f'{xpath_expr}-max'] = np.max(values)
-        return statistics
+            values.extend(e.xpath(xpath_expr, namespaces=namespaces))
+        return descriptive_statistics(values, xpath_expr)
 
     def xpath_count(self, xpath_expr, namespaces):
         """
@@ -240,14 +265,45 @@ class TagGroup:
         """
         values = []
         for e in self.group:
-            r = e.xpath(xpath_expr, namespaces=namespaces)
-            values += r
+            values.extend(e.xpath(xpath_expr, namespaces=namespaces))
 
         counts = {f'{xpath_expr}-count': len(values)}
         return counts
 
 
 
+def descriptive_statistics(values: List, key: str) -> Dict:
+    """
+    Convert the given values to float and return descriptive statistics on them.
+
+    The statistics are named after key, e.g. '{key}-mean'. No statistics are returned for an empty list of values.
+    """
+    values = np.fromiter(map(float, values), dtype=np.float64, count=len(values))
+
+    statistics = {}
+    if values.size > 0:
+        statistics[f'{key}-mean'] = values.mean()
+        statistics[f'{key}-median'] = np.median(values)
+        statistics[f'{key}-std'] = values.std()
+        statistics[f'{key}-min'] = values.min()
+        statistics[f'{key}-max'] = values.max()
+    return statistics
+
+
+def singleton_text(tag, group: List[ET.Element]) -> str:
+    """
+    Return the text of the single element in group, which must not have attributes.
+
+    This is the same as TagGroup(tag, group).is_singleton().has_no_attributes().text(), but skips the TagGroup for
+    the common case of a valid group. Invalid groups still raise the errors of TagGroup.
+    """
+    if len(group) == 1:
+        e = group[0]
+        if not e.attrib:
+            return e.text or ''
+    return TagGroup(tag, group).is_singleton().has_no_attributes().text()
+
+
 def sorted_groupby(iterable, key=None):
     """
     Sort iterable by key and then group by the same key.
@@ -258,64 +314,113 @@ def sorted_groupby(iterable, key=None):
     return groupby(sorted(iterable, key=key), key=key)
 
 
+# Messages of the warnings recorded by capture_warnings()
+_caught_warnings: List[str] = []
+
+
+def _record_warning(message, category, filename, lineno, file=None, line=None):
+    _caught_warnings.append(str(message))
+
+
+def capture_warnings():
+    """
+    Record all warnings instead of showing them.
+
+    This installs a warnings.showwarning() hook once, which is cheaper than entering warnings.catch_warnings() for
+    every file converted. It is meant to be used as the initializer of a worker process. Retrieve the recorded
+    warnings using pop_caught_warnings().
+    """
+    warnings.simplefilter('always')  # do NOT filter double occurrences
+    warnings.showwarning = _record_warning
+
+
+def pop_caught_warnings() -> List[str]:
+    """Return the messages of the warnings recorded so far and clear them."""
+    caught_warnings = _caught_warnings[:]
+    _caught_warnings.clear()
+    return caught_warnings
+
+
+def grouped_by_tag(iterable, ignore: FrozenSet[str] = frozenset()):
+    """
+    Group the given elements by their tag.
+
+    Unlike sorted_groupby(), this does not sort: The groups are built in a single pass and come in order of
+    first appearance, each as a list of elements. Elements with a tag in ignore are skipped.
+    """
+    groups = {}
+    for e in iterable:
+        tag = e.tag
+        if tag not in ignore:
+            groups.setdefault(tag, []).append(e)
+    return groups.items()
+
+
+_ALTO_NAMESPACES = frozenset({
+    "http://schema.ccs-gmbh.com/ALTO",
+    "http://www.loc.gov/standards/alto/",
+    "http://www.loc.gov/standards/alto/ns-v2#",
+    "http://www.loc.gov/standards/alto/ns-v4#",
+})
+
+
 def _to_dict(root, raise_errors):
     from .mods4pandas import mods_to_dict, mets_to_dict
     from .alto4pandas import alto_to_dict
 
-    root_name = ET.QName(root.tag)
-    if root_name.namespace == "http://www.loc.gov/mods/v3":
+    _, namespace = _split_qname(root.tag)
+    if namespace == "http://www.loc.gov/mods/v3":
         return mods_to_dict(root, raise_errors)
-    elif root_name.namespace == "http://www.loc.gov/METS/":
+    elif namespace == "http://www.loc.gov/METS/":
         return mets_to_dict(root, raise_errors)
-    elif root_name.namespace in [
-        "http://schema.ccs-gmbh.com/ALTO",
-        "http://www.loc.gov/standards/alto/",
-        "http://www.loc.gov/standards/alto/ns-v2#",
-        "http://www.loc.gov/standards/alto/ns-v4#",
-    ]:
+    elif namespace in _ALTO_NAMESPACES:
         return alto_to_dict(root, raise_errors)
     else:
-        raise ValueError(f"Unknown namespace {root_name.namespace}")
+        raise ValueError(f"Unknown namespace {namespace}")
 
 
-def flatten(d: MutableMapping, parent='', separator='_'):
+def flatten(d: Dict, parent='', separator='_'):
     """
     Flatten the given nested dict.
 
     It is assumed that d maps strings to either another dictionary (similarly structured) or some other value.
     """
-    items = []
-
-    for k, v in d.items():
-        if parent:
-            new_key = parent + separator + k
-        else:
-            new_key = k
-
-        if isinstance(v, MutableMapping):
-            items.extend(flatten(v, new_key, separator=separator).items())
+    result = {}
+
+    # Walk the nested dicts depth-first, using an explicit stack of (key prefix, items iterator) instead of
+    # recursion. This keeps the order of the keys and fills a single result dict. The key prefix already includes
+    # the separator (or is empty at the top level), so building a key is a single concatenation.
+    stack = [(parent + separator if parent else '', iter(d.items()))]
+    while stack:
+        prefix, items = stack[-1]
+        for k, v in items:
+            new_key = prefix + k
+
+            if isinstance(v, dict):
+                stack.append((new_key + separator, iter(v.items())))
+                break
+            else:
+                # The same keys occur in every record. Interning them lets all records share one string object per
+                # key, which also lets pickle send a key only once per batch of results from a worker process.
+                result[sys.intern(new_key)] = v
         else:
-            items.append((new_key, v))
+            stack.pop()
 
-    return dict(items)
+    return result
 
 
-def dicts_to_df(data_list: List[Dict], *, index_column) -> pd.DataFrame:
+def dicts_to_df(data_list: List[Dict], *, index_column) -> "pd.DataFrame":
     """
     Convert the given list of dicts to a Pandas DataFrame.
 
     The keys of the dicts make the columns.
     """
+    # Import pandas only when it is needed, it takes a noticeable part of the start-up time (e.g. for --help or in
+    # worker processes that are started by spawning)
+    import pandas as pd
 
-    # Build columns from keys
-    columns = []
-    for m in data_list:
-        for c in m.keys():
-            if c not in columns:
-                columns.append(c)
-
-    # Build data table
-    data = [[m.get(c) for c in columns] for m in data_list]
+    # Build columns from keys, in order of first appearance (dict.fromkeys() dedups in O(total keys))
+    columns = list(dict.fromkeys(c for m in data_list for c in m.keys()))
 
     # Build index
     if isinstance(index_column, str):
@@ -326,5 +431,14 @@ def dicts_to_df(data_list: List[Dict], *, index_column) -> pd.DataFrame:
     else:
         raise ValueError(f"index_column must")
 
-    df = pd.DataFrame(data=data, index=index, columns=columns)
+    # Let pandas align the (sparse) dicts to the columns, instead of building a rows × columns list ourselves
+    df = pd.DataFrame(data_list, index=index, columns=columns)
+
+    # pandas fills missing cells with NaN, but missing values in object columns (e.g. sets) have always been None
+    for c in df.columns[df.dtypes == object]:
+        column = df[c]
+        missing = column.isna()
+        if missing.any():
+            df[c] = column.where(~missing, None)
+
     return df
@@ -3,23 +3,330 @@ import csv
 import logging
 import os
 import re
-import warnings
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from lxml import etree as ET
 from itertools import groupby
-from operator import attrgetter
-from typing import Dict, List
+from typing import Dict, List, Optional
 from collections.abc import MutableMapping, Sequence
 
 import click
-import pandas as pd
 from tqdm import tqdm
 
-from .lib import sorted_groupby, TagGroup, ns, flatten, dicts_to_df
+from .lib import sorted_groupby, grouped_by_tag, TagGroup, singleton_text, ns, flatten, dicts_to_df, capture_warnings, \
+    pop_caught_warnings
 
 
 
 logger = logging.getLogger('mods4pandas')
 
+
+# Qualified names used in pages_to_dict(), built once instead of per page
+_METS_DIV = f"{{{ns['mets']}}}div"
+_METS_FPTR = f"{{{ns['mets']}}}fptr"
+_XLINK_FROM = f"{{{ns['xlink']}}}from"
+_XLINK_TO = f"{{{ns['xlink']}}}to"
+
+# Compiled XPath expressions used per file. Parameters are passed as XPath variables.
+_xpath_mods = ET.XPath('mets:dmdSec//mods:mods', namespaces=ns)
+_xpath_mets_recordIdentifier = ET.XPath(
+        '//mets:dmdSec[1]//mods:mods/mods:recordInfo/mods:recordIdentifier[@source=$source]', namespaces=ns)
+_xpath_FLocat_href = ET.XPath('mets:FLocat/@xlink:href', namespaces=ns)
+
+# Parser shared by all files parsed in a process. We build our own look-up tables, so there is no need for libxml2 to
+# collect the IDs.
+_parser = ET.XMLParser(collect_ids=False)
+
+
+def _mods_location(tag, group, value, raise_errors):
+    def only_current_location(location):
+        return location.get('type') != 'former'
+    value['location'] = TagGroup(tag, group) \
+        .filter(only_current_location) \
+        .has_attributes([{}, {'type': 'current'}]) \
+        .is_singleton().descend(raise_errors)
+
+
+def _mods_physicalLocation(tag, group, value, raise_errors):
+    def no_display_label(physical_location):
+        return physical_location.get('displayLabel') is None
+    value['physicalLocation'] = TagGroup(tag, group).filter(no_display_label).text()
+
+
+def _mods_shelfLocator(tag, group, value, raise_errors):
+    # This element should not be repeated according to MODS-AP 2.3.1, however a few of the files contain
+    # a second element with empty text and a "displayLabel" attribute set.
+    def no_display_label(shelf_locator):
+        return shelf_locator.get('displayLabel') is None
+    value['shelfLocator'] = TagGroup(tag, group) \
+        .filter(no_display_label) \
+        .force_singleton() \
+        .has_no_attributes() \
+        .text()
+
+
+def _mods_originInfo(tag, group, value, raise_errors):
+    def has_event_type(origin_info):
+        # According to MODS-AP 2.3.1, every originInfo should have its eventType set. However, some
+        # are empty and not fixable.
+        return origin_info.get('eventType') is not None
+    tag_group = TagGroup(tag, group).fix_event_type().filter(has_event_type, warn="has no eventType")
+    grouped_by_event_type = {}
+    for e in tag_group.group:
+        grouped_by_event_type.setdefault(e.attrib['eventType'], []).append(e)
+    for event_type, grouped_group in sorted(grouped_by_event_type.items()):
+        for n, e in enumerate(grouped_group):
+            value['originInfo-{}{}'.format(event_type, n)] = mods_to_dict(e, raise_errors)
+
+
+def _mods_place(tag, group, value, raise_errors):
+    value['place'] = TagGroup(tag, group).force_singleton(warn=False).has_no_attributes().descend(raise_errors)
+
+
+def _mods_placeTerm(tag, group, value, raise_errors):
+    value['placeTerm'] = TagGroup(tag, group).is_singleton().has_attributes({'type': 'text'}).text()
+
+
+def _mods_dateIssued(tag, group, value, raise_errors):
+    value['dateIssued'] = TagGroup(tag, group) \
+        .fix_date() \
+        .sort(key=lambda d: d.get('keyDate') == 'yes', reverse=True) \
+        .ignore_attributes() \
+        .force_singleton() \
+        .text()
+
+
+def _mods_dateCreated(tag, group, value, raise_errors):
+    value['dateCreated'] = TagGroup(tag, group) \
+        .fix_date() \
+        .sort(key=lambda d: d.get('keyDate') == 'yes', reverse=True) \
+        .ignore_attributes() \
+        .force_singleton() \
+        .text()
+
+
+def _mods_dateCaptured(tag, group, value, raise_errors):
+    value['dateCaptured'] = TagGroup(tag, group).fix_date().ignore_attributes().is_singleton().text()
+
+
+def _mods_dateOther(tag, group, value, raise_errors):
+    value['dateOther'] = TagGroup(tag, group).fix_date().ignore_attributes().is_singleton().text()
+
+
+def _mods_publisher(tag, group, value, raise_errors):
+    value['publisher'] = TagGroup(tag, group).force_singleton(warn=False).has_no_attributes().text()
+
+
+def _mods_edition(tag, group, value, raise_errors):
+    value['edition'] = TagGroup(tag, group).force_singleton().has_no_attributes().text()
+
+
+def _mods_classification(tag, group, value, raise_errors):
+    sub_groups = {}
+    for e in group:
+        sub_groups.setdefault(e.attrib['authority'], []).append(e)
+    for authority, sub_group in sub_groups.items():
+        value['classification-{}'.format(authority)] = TagGroup(tag, sub_group).text_set()
+
+
+def _mods_recordInfo(tag, group, value, raise_errors):
+    value['recordInfo'] = TagGroup(tag, group).is_singleton().has_no_attributes().descend(raise_errors)
+
+
+def _mods_recordIdentifier(tag, group, value, raise_errors):
+    # By default we assume source="gbv-ppn" mods:recordIdentifiers (= PPNs),
+    # however, in mods:relatedItems, there may be source="dnb-ppns",
+    # which we need to distinguish by using a separate field name.
+    try:
+        value['recordIdentifier'] = TagGroup(tag, group).is_singleton().has_attributes({'source': 'gbv-ppn'}).text()
+    except ValueError:
+        value['recordIdentifier-dnb-ppn'] = TagGroup(tag, group).is_singleton().has_attributes({'source': 'dnb-ppn'}).text()
+
+
+def _mods_identifier(tag, group, value, raise_errors):
+    for e in group:
+        attrib = e.attrib
+        if len(attrib) != 1:
+            raise ValueError('Unknown attributes for identifier {}'.format(attrib))
+        value['identifier-{}'.format(attrib['type'])] = e.text
+
+
+def _mods_titleInfo(tag, group, value, raise_errors):
+    def only_standard_title(title_info):
+        return title_info.get('type') is None
+    value['titleInfo'] = TagGroup(tag, group) \
+        .filter(only_standard_title) \
+        .is_singleton().has_no_attributes().descend(raise_errors)
+
+
+def _mods_title(tag, group, value, raise_errors):
+    value['title'] = singleton_text(tag, group)
+
+
+def _mods_partName(tag, group, value, raise_errors):
+    value['partName'] = singleton_text(tag, group)
+
+
+def _mods_subTitle(tag, group, value, raise_errors):
+    value['subTitle'] = TagGroup(tag, group).force_singleton().has_no_attributes().text()
+
+
+def _mods_abstract(tag, group, value, raise_errors):
+    value['abstract'] = TagGroup(tag, group).has_no_attributes().text()
+
+
+def _mods_subject(tag, group, value, raise_errors):
+    sub_groups = {}
+    for e in group:
+        sub_groups.setdefault(e.get('authority'), []).append(e)
+    for authority, sub_group in sub_groups.items():
+        k = 'subject-{}'.format(authority) if authority is not None else 'subject'
+        value[k] = TagGroup(tag, sub_group).force_singleton().descend(raise_errors)
+
+
+def _mods_text_set_unused(tag, group, value, raise_errors):
+    # Checked, but not (yet) part of the value
+    TagGroup(tag, group).text_set()
+
+
+def _mods_genre(tag, group, value, raise_errors):
+    texts = {}
+    for e in group:
+        texts.setdefault(e.get('authority'), set()).add(e.text)
+    for authority, authority_texts in texts.items():
+        k = 'genre-{}'.format(authority) if authority is not None else 'genre'
+        value[k] = authority_texts
+
+
+def _mods_language(tag, group, value, raise_errors):
+    value["language"] = TagGroup(tag, group) \
+        .merge_sub_tags_to_set()
+
+
+def _mods_languageTerm(tag, group, value, raise_errors):
+    value['languageTerm'] = TagGroup(tag, group) \
+        .has_attributes({'authority': 'iso639-2b', 'type': 'code'}) \
+        .text_set()
+
+
+def _mods_scriptTerm(tag, group, value, raise_errors):
+    value['scriptTerm'] = TagGroup(tag, group) \
+        .fix_script_term() \
+        .has_attributes({'authority': 'iso15924', 'type': 'code'}) \
+        .text_set()
+
+
+def _mods_relatedItem(tag, group, value, raise_errors):
+    tag_group = TagGroup(tag, group)
+    for type_, grouped_group in sorted_groupby(tag_group.group, key=lambda g: g.attrib['type']):
+        sub_tag = 'relatedItem-{}'.format(type_)
+        grouped_group = list(grouped_group)
+        if type_ in ["original", "host"]:
+            value[sub_tag] = TagGroup(sub_tag, grouped_group).is_singleton().descend(raise_errors)
+        else:
+            # TODO type="series"
+            pass
+
+
+def _mods_name(tag, group, value, raise_errors):
+    for n, e in enumerate(group):
+        value['name{}'.format(n)] = mods_to_dict(e, raise_errors)
+
+
+def _mods_role(tag, group, value, raise_errors):
+    value["role"] = TagGroup(tag, group) \
+        .has_no_attributes() \
+        .merge_sub_tags_to_set()
+
+
+def _mods_roleTerm(tag, group, value, raise_errors):
+    value['roleTerm'] = TagGroup(tag, group) \
+        .has_attributes({'authority': 'marcrelator', 'type': 'code'}) \
+        .text_set()
+
+
+def _mods_namePart(tag, group, value, raise_errors):
+    for e in group:
+        if not e.get('type'):
+            value['namePart'] = e.text
+        else:
+            value['namePart-{}'.format(e.attrib['type'])] = e.text
+
+
+def _mods_displayForm(tag, group, value, raise_errors):
+    value['displayForm'] = singleton_text(tag, group)
+
+
+def _mods_accessCondition(tag, group, value, raise_errors):
+    for e in group:
+        type_ = e.get('type')
+        if not type_:
+            raise ValueError('Unknown attributes for accessCondition {}'.format(e.attrib))
+        value['accessCondition-{}'.format(type_)] = e.text
+
+
+def _mods_typeOfResource(tag, group, value, raise_errors):
+    value['typeOfResource'] = singleton_text(tag, group)
+
+
+# Handlers for the MODS elements, by tag. A handler converts the group of elements with that tag and stores the
+# result(s) in value.
+_MODS_HANDLERS = {
+    '{http://www.loc.gov/mods/v3}location': _mods_location,
+    '{http://www.loc.gov/mods/v3}physicalLocation': _mods_physicalLocation,
+    '{http://www.loc.gov/mods/v3}shelfLocator': _mods_shelfLocator,
+    '{http://www.loc.gov/mods/v3}originInfo': _mods_originInfo,
+    '{http://www.loc.gov/mods/v3}place': _mods_place,
+    '{http://www.loc.gov/mods/v3}placeTerm': _mods_placeTerm,
+    '{http://www.loc.gov/mods/v3}dateIssued': _mods_dateIssued,
+    '{http://www.loc.gov/mods/v3}dateCreated': _mods_dateCreated,
+    '{http://www.loc.gov/mods/v3}dateCaptured': _mods_dateCaptured,
+    '{http://www.loc.gov/mods/v3}dateOther': _mods_dateOther,
+    '{http://www.loc.gov/mods/v3}publisher': _mods_publisher,
+    '{http://www.loc.gov/mods/v3}edition': _mods_edition,
+    '{http://www.loc.gov/mods/v3}classification': _mods_classification,
+    '{http://www.loc.gov/mods/v3}recordInfo': _mods_recordInfo,
+    '{http://www.loc.gov/mods/v3}recordIdentifier': _mods_recordIdentifier,
+    '{http://www.loc.gov/mods/v3}identifier': _mods_identifier,
+    '{http://www.loc.gov/mods/v3}titleInfo': _mods_titleInfo,
+    '{http://www.loc.gov/mods/v3}title': _mods_title,
+    '{http://www.loc.gov/mods/v3}partName': _mods_partName,
+    '{http://www.loc.gov/mods/v3}subTitle': _mods_subTitle,
+    '{http://www.loc.gov/mods/v3}abstract': _mods_abstract,
+    '{http://www.loc.gov/mods/v3}subject': _mods_subject,
+    '{http://www.loc.gov/mods/v3}topic': _mods_text_set_unused,
+    '{http://www.loc.gov/mods/v3}geographic': _mods_text_set_unused,
+    '{http://www.loc.gov/mods/v3}temporal': _mods_text_set_unused,
+    '{http://www.loc.gov/mods/v3}genre': _mods_genre,
+    '{http://www.loc.gov/mods/v3}language': _mods_language,
+    '{http://www.loc.gov/mods/v3}languageTerm': _mods_languageTerm,
+    '{http://www.loc.gov/mods/v3}scriptTerm': _mods_scriptTerm,
+    '{http://www.loc.gov/mods/v3}relatedItem': _mods_relatedItem,
+    '{http://www.loc.gov/mods/v3}name': _mods_name,
+    '{http://www.loc.gov/mods/v3}role': _mods_role,
+    '{http://www.loc.gov/mods/v3}roleTerm': _mods_roleTerm,
+    '{http://www.loc.gov/mods/v3}namePart': _mods_namePart,
+    '{http://www.loc.gov/mods/v3}displayForm': _mods_displayForm,
+    '{http://www.loc.gov/mods/v3}accessCondition': _mods_accessCondition,
+    '{http://www.loc.gov/mods/v3}typeOfResource': _mods_typeOfResource,
+}
+
+# Elements that are explicitly ignored. They are skipped while grouping, so they are not even collected.
+_MODS_IGNORED = frozenset({
+    # This could be useful if distinguished by type attribute.
+    '{http://www.loc.gov/mods/v3}note',
+    '{http://www.loc.gov/mods/v3}part',
+    '{http://www.loc.gov/mods/v3}cartographics',
+    # TODO Use this (e.g. <mods:nameIdentifier type="ppn">106168096</mods:nameIdentifier>) or the
+    # mods:name@valueURI to disambiguate
+    '{http://www.loc.gov/mods/v3}nameIdentifier',
+    '{http://www.loc.gov/mods/v3}physicalDescription',
+    '{http://www.loc.gov/mods/v3}extension',
+    # XXX Ignore nested mods:mods for now (used in mods:subject)
+    '{http://www.loc.gov/mods/v3}mods',
+})
+
+
 def mods_to_dict(mods, raise_errors=True):
     """Convert MODS metadata to a nested dictionary"""
 
@@ -28,182 +335,12 @@ def mods_to_dict(mods, raise_errors=True):
 
     value = {}
 
-    # Iterate through each group of tags
-    for tag, group in sorted_groupby(mods, key=attrgetter('tag')):
-        group = list(group)
-        if tag == '{http://www.loc.gov/mods/v3}location':
-            def only_current_location(location):
-                return location.get('type') != 'former'
-            value['location'] = TagGroup(tag, group) \
-                .filter(only_current_location) \
-                .has_attributes([{}, {'type': 'current'}]) \
-                .is_singleton().descend(raise_errors)
-        elif tag == '{http://www.loc.gov/mods/v3}physicalLocation':
-            def no_display_label(physical_location):
-                return physical_location.get('displayLabel') is None
-            value['physicalLocation'] = TagGroup(tag, group).filter(no_display_label).text()
-        elif tag == '{http://www.loc.gov/mods/v3}shelfLocator':
-            # This element should not be repeated according to MODS-AP 2.3.1, however a few of the files contain
-            # a second element with empty text and a "displayLabel" attribute set.
-            def no_display_label(shelf_locator):
-                return shelf_locator.get('displayLabel') is None
-            value['shelfLocator'] = TagGroup(tag, group) \
-                .filter(no_display_label) \
-                .force_singleton() \
-                .has_no_attributes() \
-                .text()
-        elif tag == '{http://www.loc.gov/mods/v3}originInfo':
-            def has_event_type(origin_info):
-                # According to MODS-AP 2.3.1, every originInfo should have its eventType set. However, some
-                # are empty and not fixable.
-                return origin_info.attrib.get('eventType') is not None
-            tag_group = TagGroup(tag, group).fix_event_type().filter(has_event_type, warn="has no eventType")
-            for event_type, grouped_group in sorted_groupby(tag_group.group, key=lambda g: g.attrib['eventType']):
-                for n, e in enumerate(grouped_group):
-                    value['originInfo-{}{}'.format(event_type, n)] = mods_to_dict(e, raise_errors)
-        elif tag == '{http://www.loc.gov/mods/v3}place':
-            value['place'] = TagGroup(tag, group).force_singleton(warn=False).has_no_attributes().descend(raise_errors)
-        elif tag == '{http://www.loc.gov/mods/v3}placeTerm':
-            value['placeTerm'] = TagGroup(tag, group).is_singleton().has_attributes({'type': 'text'}).text()
-        elif tag == '{http://www.loc.gov/mods/v3}dateIssued':
-            value['dateIssued'] = TagGroup(tag, group) \
-                .fix_date() \
-                .sort(key=lambda d: d.attrib.get('keyDate') == 'yes', reverse=True) \
-                .ignore_attributes() \
-                .force_singleton() \
-                .text()
-        elif tag == '{http://www.loc.gov/mods/v3}dateCreated':
-            value['dateCreated'] = TagGroup(tag, group) \
-                .fix_date() \
-                .sort(key=lambda d: d.attrib.get('keyDate') == 'yes', reverse=True) \
-                .ignore_attributes() \
-                .force_singleton() \
-                .text()
-        elif tag == '{http://www.loc.gov/mods/v3}dateCaptured':
-            value['dateCaptured'] = TagGroup(tag, group).fix_date().ignore_attributes().is_singleton().text()
-        elif tag == '{http://www.loc.gov/mods/v3}dateOther':
-            value['dateOther'] = TagGroup(tag, group).fix_date().ignore_attributes().is_singleton().text()
-        elif tag == '{http://www.loc.gov/mods/v3}publisher':
-            value['publisher'] = TagGroup(tag, group).force_singleton(warn=False).has_no_attributes().text()
-        elif tag == '{http://www.loc.gov/mods/v3}edition':
-            value['edition'] = TagGroup(tag, group).force_singleton().has_no_attributes().text()
-        elif tag == '{http://www.loc.gov/mods/v3}classification':
-            authorities = {e.attrib['authority'] for e in group}
-            for authority in authorities:
-                sub_group = [e for e in group if e.attrib.get('authority') == authority]
-                value['classification-{}'.format(authority)] = TagGroup(tag, sub_group).text_set()
-        elif tag == '{http://www.loc.gov/mods/v3}recordInfo':
-            value['recordInfo'] = TagGroup(tag, group).is_singleton().has_no_attributes().descend(raise_errors)
-        elif tag == '{http://www.loc.gov/mods/v3}recordIdentifier':
-            # By default we assume source="gbv-ppn" mods:recordIdentifiers (= PPNs),
-            # however, in mods:relatedItems, there may be source="dnb-ppns",
-            # which we need to distinguish by using a separate field name.
-            try:
-                value['recordIdentifier'] = TagGroup(tag, group).is_singleton().has_attributes({'source': 'gbv-ppn'}).text()
-            except ValueError:
-                value['recordIdentifier-dnb-ppn'] = TagGroup(tag, group).is_singleton().has_attributes({'source': 'dnb-ppn'}).text()
-        elif tag == '{http://www.loc.gov/mods/v3}identifier':
-            for e in group:
-                if len(e.attrib) != 1:
-                    raise ValueError('Unknown attributes for identifier {}'.format(e.attrib))
-                value['identifier-{}'.format(e.attrib['type'])] = e.text
-        elif tag == '{http://www.loc.gov/mods/v3}titleInfo':
-            def only_standard_title(title_info):
-                return title_info.attrib.get('type') is None
-            value['titleInfo'] = TagGroup(tag, group) \
-                .filter(only_standard_title) \
-                .is_singleton().has_no_attributes().descend(raise_errors)
-        elif tag == '{http://www.loc.gov/mods/v3}title':
-            value['title'] = TagGroup(tag, group).is_singleton().has_no_attributes().text()
-        elif tag == '{http://www.loc.gov/mods/v3}partName':
-            value['partName'] = TagGroup(tag, group).is_singleton().has_no_attributes().text()
-        elif tag == '{http://www.loc.gov/mods/v3}subTitle':
-            value['subTitle'] = TagGroup(tag, group).force_singleton().has_no_attributes().text()
-        elif tag == '{http://www.loc.gov/mods/v3}note':
-            # This could be useful if distinguished by type attribute.
-            pass
-        elif tag == '{http://www.loc.gov/mods/v3}part':
-            pass
-        elif tag == '{http://www.loc.gov/mods/v3}abstract':
-            value['abstract'] = TagGroup(tag, group).has_no_attributes().text()
-        elif tag == '{http://www.loc.gov/mods/v3}subject':
-            authorities = {e.attrib.get('authority') for e in group}
-            for authority in authorities:
-                k = 'subject-{}'.format(authority) if authority is not None else 'subject'
-                sub_group = [e for e in group if e.attrib.get('authority') == authority]
-                value[k] = TagGroup(tag, sub_group).force_singleton().descend(raise_errors)
-        elif tag == '{http://www.loc.gov/mods/v3}topic':
-            TagGroup(tag, group).text_set()
-        elif tag == '{http://www.loc.gov/mods/v3}cartographics':
-            pass
-        elif tag == '{http://www.loc.gov/mods/v3}geographic':
-            TagGroup(tag, group).text_set()
-        elif tag == '{http://www.loc.gov/mods/v3}temporal':
-            TagGroup(tag, group).text_set()
-        elif tag == '{http://www.loc.gov/mods/v3}genre':
-            authorities = {e.attrib.get('authority') for e in group}
-            for authority in authorities:
-                k = 'genre-{}'.format(authority) if authority is not None else 'genre'
-                value[k] = {e.text for e in group if e.attrib.get('authority') == authority}
-        elif tag == '{http://www.loc.gov/mods/v3}language':
-            value["language"] = TagGroup(tag, group) \
-                .merge_sub_tags_to_set()
-        elif tag == '{http://www.loc.gov/mods/v3}languageTerm':
-            value['languageTerm'] = TagGroup(tag, group) \
-                .has_attributes({'authority': 'iso639-2b', 'type': 'code'}) \
-                .text_set()
-        elif tag == '{http://www.loc.gov/mods/v3}scriptTerm':
-            value['scriptTerm'] = TagGroup(tag, group) \
-                .fix_script_term() \
-                .has_attributes({'authority': 'iso15924', 'type': 'code'}) \
-                .text_set()
-        elif tag == '{http://www.loc.gov/mods/v3}relatedItem':
-            tag_group = TagGroup(tag, group)
-            for type_, grouped_group in sorted_groupby(tag_group.group, key=lambda g: g.attrib['type']):
-                sub_tag = 'relatedItem-{}'.format(type_)
-                grouped_group = list(grouped_group)
-                if type_ in ["original", "host"]:
-                    value[sub_tag] = TagGroup(sub_tag, grouped_group).is_singleton().descend(raise_errors)
-                else:
-                    # TODO type="series"
-                    pass
-        elif tag == '{http://www.loc.gov/mods/v3}name':
-            for n, e in enumerate(group):
-                value['name{}'.format(n)] = mods_to_dict(e, raise_errors)
-        elif tag == '{http://www.loc.gov/mods/v3}role':
-            value["role"] = TagGroup(tag, group) \
-                .has_no_attributes() \
-                .merge_sub_tags_to_set()
-        elif tag == '{http://www.loc.gov/mods/v3}roleTerm':
-            value['roleTerm'] = TagGroup(tag, group) \
-                .has_attributes({'authority': 'marcrelator', 'type': 'code'}) \
-                .text_set()
-        elif tag == '{http://www.loc.gov/mods/v3}namePart':
-            for e in group:
-                if not e.attrib.get('type'):
-                    value['namePart'] = e.text
-                else:
-                    value['namePart-{}'.format(e.attrib['type'])] = e.text
-        elif tag == '{http://www.loc.gov/mods/v3}nameIdentifier':
-            # TODO Use this (e.g. <mods:nameIdentifier type="ppn">106168096</mods:nameIdentifier>) or the
-            # mods:name@valueURI to disambiguate
-            pass
-        elif tag == '{http://www.loc.gov/mods/v3}displayForm':
-            value['displayForm'] = TagGroup(tag, group).is_singleton().has_no_attributes().text()
-        elif tag == '{http://www.loc.gov/mods/v3}physicalDescription':
-            pass
-        elif tag == '{http://www.loc.gov/mods/v3}extension':
-            pass
-        elif tag == '{http://www.loc.gov/mods/v3}accessCondition':
-            for e in group:
-                if not e.attrib.get('type'):
-                    raise ValueError('Unknown attributes for accessCondition {}'.format(e.attrib))
-                value['accessCondition-{}'.format(e.attrib['type'])] = e.text
-        elif tag == '{http://www.loc.gov/mods/v3}typeOfResource':
-            value['typeOfResource'] = TagGroup(tag, group).is_singleton().has_no_attributes().text()
-        elif tag == '{http://www.loc.gov/mods/v3}mods':
-            # XXX Ignore nested mods:mods for now (used in mods:subject)
-            pass
+    # Iterate through each group of tags, skipping ignored elements. Only the (few) distinct tags are sorted, not the
+    # elements themselves.
+    for tag, group in sorted(grouped_by_tag(mods, ignore=_MODS_IGNORED)):
+        handler = _MODS_HANDLERS.get(tag)
+        if handler is not None:
+            handler(tag, group, value, raise_errors)
         else:
             if raise_errors:
                 raise ValueError('Unknown tag "{}"'.format(tag))
@@ -213,6 +350,38 @@ def mods_to_dict(mods, raise_errors=True):
     return value
 
 
+def _mets_fileSec(tag, group, value, raise_errors):
+    value['fileSec'] = TagGroup(tag, group) \
+        .is_singleton().descend(raise_errors)
+
+
+def _mets_fileGrp(tag, group, value, raise_errors):
+    for e in group:
+        use = e.get('USE')
+        if not use:
+            raise ValueError('No USE attribute for fileGrp {}'.format(e))
+        value[f'fileGrp-{use}-count'] = len(e)
+
+
+# Handlers for the METS elements, by tag. A handler converts the group of elements with that tag and stores the
+# result(s) in value.
+# XXX Namespaces seem to use a trailing / sometimes, sometimes not.
+#     (e.g. {http://www.loc.gov/METS/} vs {http://www.loc.gov/METS})
+_METS_HANDLERS = {
+    '{http://www.loc.gov/METS/}fileSec': _mets_fileSec,
+    '{http://www.loc.gov/METS/}fileGrp': _mets_fileGrp,
+}
+
+# Elements that are explicitly ignored (TODO)
+_METS_IGNORED = frozenset({
+    '{http://www.loc.gov/METS/}amdSec',
+    '{http://www.loc.gov/METS/}dmdSec',
+    '{http://www.loc.gov/METS/}metsHdr',
+    '{http://www.loc.gov/METS/}structLink',
+    '{http://www.loc.gov/METS/}structMap',
+})
+
+
 def mets_to_dict(mets, raise_errors=True):
     """Convert METS metadata to a nested dictionary"""
 
@@ -221,34 +390,15 @@ def mets_to_dict(mets, raise_errors=True):
 
     value = {}
 
-    # Iterate through each group of tags
-    for tag, group in sorted_groupby(mets, key=attrgetter('tag')):
-        group = list(group)
-
-        # XXX Namespaces seem to use a trailing / sometimes, sometimes not.
-        #     (e.g. {http://www.loc.gov/METS/} vs {http://www.loc.gov/METS})
-        if tag == '{http://www.loc.gov/METS/}amdSec':
-            pass  # TODO
-        elif tag == '{http://www.loc.gov/METS/}dmdSec':
-            pass  # TODO
-        elif tag == '{http://www.loc.gov/METS/}metsHdr':
-            pass  # TODO
-        elif tag == '{http://www.loc.gov/METS/}structLink':
-            pass  # TODO
-        elif tag == '{http://www.loc.gov/METS/}structMap':
-            pass  # TODO
-        elif tag == '{http://www.loc.gov/METS/}fileSec':
-            value['fileSec'] = TagGroup(tag, group) \
-                .is_singleton().descend(raise_errors)
-        elif tag == '{http://www.loc.gov/METS/}fileGrp':
-            for e in group:
-                use = e.attrib.get('USE')
-                if not use:
-                    raise ValueError('No USE attribute for fileGrp {}'.format(e))
-                value[f'fileGrp-{use}-count'] = len(e)
+    # Iterate through each group of tags, skipping ignored elements. Only the (few) distinct tags are sorted, not the
+    # elements themselves.
+    for tag, group in sorted(grouped_by_tag(mets, ignore=_METS_IGNORED)):
+        handler = _METS_HANDLERS.get(tag)
+        if handler is not None:
+            handler(tag, group, value, raise_errors)
         else:
             if raise_errors:
-                print(value)
+                logger.debug('Partial value at unknown tag %s: %r', tag, value)
                 raise ValueError('Unknown tag "{}"'.format(tag))
             else:
                 pass
@@ -261,8 +411,7 @@ def pages_to_dict(mets, raise_errors=True) -> List[Dict]:
 
     # PPN
     def get_mets_recordIdentifier(*, source="gbv-ppn"):
-        return (mets.xpath(f'//mets:dmdSec[1]//mods:mods/mods:recordInfo/mods:recordIdentifier[@source="{source}"]',
-                           namespaces=ns) or [None])[0].text
+        return (_xpath_mets_recordIdentifier(mets, source=source) or [None])[0].text
     ppn = get_mets_recordIdentifier()
 
     # Getting per-page/structure information is a bit different
@@ -284,41 +433,77 @@ def pages_to_dict(mets, raise_errors=True) -> List[Dict]:
         raise ValueError("No fileSec found")
 
     div_physSequence = structMap_PHYSICAL[0]
-    assert div_physSequence.attrib.get("TYPE") == "physSequence"
-
-
-    # Build a look-up table to get mets:file by @ID
-    # This cuts retrieving the mets:file down to half the time.
-    mets_file_by_ID = {}
-    def _init_mets_file_by_ID():
-        for f in fileSec.iterfind('./mets:fileGrp/mets:file', ns):
-            mets_file_by_ID[f.attrib.get("ID")] = f
-    _init_mets_file_by_ID()
+    assert div_physSequence.get("TYPE") == "physSequence"
+
+
+    # Build a look-up table to get the fileGrp/@USE and FLocat/@xlink:href of a mets:file by @ID
+    mets_file_info_by_ID = {}
+    def _init_mets_file_info_by_ID():
+        for fileGrp in fileSec.iterfind('./mets:fileGrp', ns):
+            fileGrp_USE = fileGrp.get("USE")
+            for f in fileGrp.iterfind('./mets:file', ns):
+                file_FLocat_href = (_xpath_FLocat_href(f) or [None])[0]
+                mets_file_info_by_ID[f.get("ID")] = (fileGrp_USE, file_FLocat_href)
+    _init_mets_file_info_by_ID()
+
+    # Build look-up tables for the logical structMap divs by @ID and for the smLinks by their target (the ID of the
+    # physical page), so that the structure of a page does not need a search through the whole document.
+    mets_div_by_ID = {}
+    def _init_mets_div_by_ID():
+        for d in structMap_LOGICAL.iter(_METS_DIV):
+            mets_div_by_ID.setdefault(d.get("ID"), d)
+    _init_mets_div_by_ID()
+
+    # Build a look-up table for the ancestor divs of each logical div. iter() visits a parent before its children,
+    # so the ancestors of the parent are always known already.
+    mets_div_parents = {}
+    def _init_mets_div_parents():
+        for d in structMap_LOGICAL.iter(_METS_DIV):
+            parent = d.getparent()
+            if parent.tag == _METS_DIV:
+                mets_div_parents[d] = (parent,) + mets_div_parents[parent]
+            else:
+                mets_div_parents[d] = ()
+    _init_mets_div_parents()
 
-    def get_mets_file(*, ID):
-        if ID:
-            return mets_file_by_ID[ID]
+    sm_link_froms_by_to = {}
+    def _init_sm_link_froms_by_to():
+        for sm_link in mets.iterfind('./mets:structLink/mets:smLink', ns):
+            xlink_to = sm_link.get(_XLINK_TO)
+            xlink_from = sm_link.get(_XLINK_FROM)
+            sm_link_froms_by_to.setdefault(xlink_to, []).append(xlink_from)
+    _init_sm_link_froms_by_to()
 
     def get_mets_div(*, ID):
         if ID:
-            return structMap_LOGICAL.findall(f'.//mets:div[@ID="{ID}"]', ns)
+            div = mets_div_by_ID.get(ID)
+            if div is not None:
+                return [div]
+        return []
+
+    # The same logical divs are referenced by many pages, so build the column name of a div's type only once
+    struct_type_key_by_div = {}
+    def get_struct_type_key(div):
+        key = struct_type_key_by_div.get(div)
+        if key is None:
+            type_ = div.get("TYPE")
+            assert type_
+            key = struct_type_key_by_div[div] = f"structMap-LOGICAL_TYPE_{type_}"
+        return key
 
     for page in div_physSequence:
 
         # TODO sort by ORDER?
-        assert page.attrib.get("TYPE") == "page"
+        assert page.get("TYPE") == "page"
         page_dict = {}
         page_dict["ppn"] = ppn
-        page_dict["ID"] = page.attrib.get("ID")
+        page_dict["ID"] = page.get("ID")
         for fptr in page:
-            assert fptr.tag == "{http://www.loc.gov/METS/}fptr"
-            file_id = fptr.attrib.get("FILEID")
+            assert fptr.tag == _METS_FPTR
+            file_id = fptr.get("FILEID")
             assert file_id
 
-            file_ = get_mets_file(ID=file_id)
-            assert file_ is not None
-            fileGrp_USE = file_.getparent().attrib.get("USE")
-            file_FLocat_href = (file_.xpath('mets:FLocat/@xlink:href', namespaces=ns) or [None])[0]
+            fileGrp_USE, file_FLocat_href = mets_file_info_by_ID[file_id]
             page_dict[f"fileGrp_{fileGrp_USE}_file_FLocat_href"] = file_FLocat_href
 
         def get_struct_log(*, to_phys):
@@ -332,47 +517,76 @@ def pages_to_dict(mets, raise_errors=True) -> List[Dict]:
             # This is all XLink, there might be a more generic way to traverse the links. However, currently,
             # it suffices to do this the old-fashioned way.
 
-            sm_links = mets.findall(
-                    f'./mets:structLink/mets:smLink[@xlink:to="{to_phys}"]', ns
-            )
-
             targets = []
-            for sm_link in sm_links:
-                xlink_from = sm_link.attrib.get(f"{{{ns['xlink']}}}from")
+            for xlink_from in sm_link_froms_by_to.get(to_phys, []):
                 targets.extend(get_mets_div(ID=xlink_from))
             return targets
 
-        struct_divs = set(get_struct_log(to_phys=page_dict["ID"]))
-
         # In our documents, there are already links to parent elements, but we want to make
         # sure and add them.
         def get_struct_log_parents(div):
-            cursor = div
-            while (cursor := cursor.getparent()).tag == f"{{{ns['mets']}}}div":
-                yield cursor
+            return mets_div_parents[div]
 
-        struct_divs_to_add = set()
-        for struct_div in struct_divs:
-            struct_divs_to_add.update(get_struct_log_parents(struct_div))
-        struct_divs.update(struct_divs_to_add)
+        # A div is only ever added together with all of its ancestors, so a div that is already in struct_divs
+        # does not need its ancestors added again.
+        struct_divs = set()
+        for struct_div in get_struct_log(to_phys=page_dict["ID"]):
+            if struct_div not in struct_divs:
+                struct_divs.add(struct_div)
+                struct_divs.update(get_struct_log_parents(struct_div))
 
         # Populate structure type indicator variables
         for struct_div in struct_divs:
-            type_ = struct_div.attrib.get("TYPE")
-            assert type_
-            page_dict[f"structMap-LOGICAL_TYPE_{type_}"] = 1
+            page_dict[get_struct_type_key(struct_div)] = 1
 
         result.append(page_dict)
 
     return result
 
 
+def _process_one(mets_file, with_page_info=False):
+    """
+    Convert the given METS file to a flat dict and, optionally, to a list of per-page dicts.
+
+    Return the dict (or None if the conversion failed), the per-page dicts and the messages of the warnings caught
+    while converting. This runs in a worker process (set up with capture_warnings()), so it returns only picklable
+    values.
+    """
+    try:
+        root = ET.parse(mets_file, _parser).getroot()
+        mets = root # XXX .find('mets:mets', ns) does not work here
+        mods = (_xpath_mods(root) or [None])[0]
+
+        # MODS
+        d = flatten(mods_to_dict(mods, raise_errors=True))
+
+        # METS
+        d.update(flatten(mets_to_dict(mets, raise_errors=True), parent='mets'))
+        # "meta"
+        d['mets_file'] = mets_file
+
+        # METS - per-page
+        page_info_doc = []
+        if with_page_info:
+            page_info_doc = pages_to_dict(mets, raise_errors=True)
+
+        return d, page_info_doc, pop_caught_warnings()
+    except Exception as e:
+        logger.error('Exception in {}: {}'.format(mets_file, e))
+        #import traceback; traceback.print_exc()
+        pop_caught_warnings()
+        return None, [], []
+
+
 @click.command()
 @click.argument('mets_files', type=click.Path(exists=True), required=True, nargs=-1)
 @click.option('--output', '-o', 'output_file', type=click.Path(), help='Output Parquet file',
               default='mods_info_df.parquet', show_default=True)
 @click.option('--output-page-info', type=click.Path(), help='Output page info Parquet file')
-def process(mets_files: List[str], output_file: str, output_page_info: str):
+@click.option('--workers', type=click.IntRange(min=1), help='Number of worker processes [default: number of CPUs]')
+@click.option('--chunksize', type=click.IntRange(min=1), help='Number of files sent to a worker at once',
+              default=16, show_default=True)
+def process(mets_files: List[str], output_file: str, output_page_info: str, workers: Optional[int], chunksize: int):
     """
     A tool to convert the MODS metadata in INPUT to a pandas DataFrame.
 
@@ -389,52 +603,28 @@ def process(mets_files: List[str], output_file: str, output_page_info: str):
     for m in mets_files:
         if os.path.isdir(m):
             logger.info('Scanning directory {}'.format(m))
-            mets_files_real.extend(f.path for f in tqdm(os.scandir(m), leave=False)
-                                   if f.is_file() and not f.name.startswith('.'))
+            with os.scandir(m) as it:
+                # DirEntry.is_file() does not need another stat() on most platforms
+                mets_files_real.extend(f.path for f in it if f.is_file() and not f.name.startswith('.'))
         else:
             mets_files_real.append(m)
 
-    # Process METS files
-    with open(output_file + '.warnings.csv', 'w') as csvfile:
+    # Process METS files, in parallel. The files are independent of each other, so the worker processes only
+    # have to send back the resulting dicts and the warnings.
+    with open(output_file + '.warnings.csv', 'w', newline='', buffering=1 << 20) as csvfile, \
+            ProcessPoolExecutor(max_workers=workers, initializer=capture_warnings) as executor:
         csvwriter = csv.writer(csvfile)
         mods_info = []
         page_info = []
         logger.info('Processing METS files')
-        for mets_file in tqdm(mets_files_real, leave=False):
-            try:
-                root = ET.parse(mets_file).getroot()
-                mets = root # XXX .find('mets:mets', ns) does not work here
-                mods = root.find('mets:dmdSec//mods:mods', ns)
-
-                with warnings.catch_warnings(record=True) as caught_warnings:
-                    warnings.simplefilter('always')  # do NOT filter double occurrences
-
-                    # MODS
-                    d = flatten(mods_to_dict(mods, raise_errors=True))
-
-                    # METS
-                    d_mets = flatten(mets_to_dict(mets, raise_errors=True))
-                    for k, v in d_mets.items():
-                        d[f"mets_{k}"] = v
-                    # "meta"
-                    d['mets_file'] = mets_file
-
-                    # METS - per-page
-                    if output_page_info:
-                        page_info_doc: list[dict] = pages_to_dict(mets, raise_errors=True)
-
-                    mods_info.append(d)
-                    if output_page_info:
-                        page_info.extend(page_info_doc)
-
-                    if caught_warnings:
-                        # PyCharm thinks caught_warnings is not Iterable:
-                        # noinspection PyTypeChecker
-                        for caught_warning in caught_warnings:
-                            csvwriter.writerow([mets_file, caught_warning.message])
-            except Exception as e:
-                logger.error('Exception in {}: {}'.format(mets_file, e))
-                #import traceback; traceback.print_exc()
+        results = executor.map(partial(_process_one, with_page_info=bool(output_page_info)), mets_files_real,
+                               chunksize=chunksize)
+        for mets_file, (d, page_info_doc, caught_warnings) in tqdm(zip(mets_files_real, results),
+                                                                   total=len(mets_files_real), leave=False):
+            if d is not None:
+                mods_info.append(d)
+                page_info.extend(page_info_doc)
+            csvwriter.writerows([mets_file, caught_warning] for caught_warning in caught_warnings)
 
     # Convert the mods_info List[Dict] to a pandas DataFrame
     mods_info_df = dicts_to_df(mods_info, index_column="recordInfo_recordIdentifier")
@@ -454,9 +644,6 @@ def process(mets_files: List[str], output_file: str, output_page_info: str):
 def main():
     logging.basicConfig(level=logging.INFO)
 
-    for prefix, uri in ns.items():
-        ET.register_namespace(prefix, uri)
-
     process()
 
 
@@ -1,12 +1,15 @@
 from lxml import etree as ET
 
 
-from mods4pandas.alto4pandas import alto_to_dict
+from mods4pandas.alto4pandas import alto_to_dict, walk
 from mods4pandas.lib import flatten
 
 
+# Parse like the tools do (see _parser there)
+_parser = ET.XMLParser(collect_ids=False)
+
 def dict_fromstring(x):
-   return flatten(alto_to_dict(ET.fromstring(x)))
+   return flatten(alto_to_dict(ET.fromstring(x, _parser)))
 
 def test_Page_counts():
     """
@@ -79,3 +82,21 @@ def test_String_TAGREF_counts():
     """)
     assert d['Layout_Page_//alto:String[@TAGREFS]-count'] == 3
     assert d['Layout_Page_String-count'] == 4
+
+def test_walk(tmp_path):
+    """
+    walk() should find the files in a directory tree, skipping hidden files and directories
+    """
+    for f in ["a.xml", ".hidden.xml", ".hidden/b.xml", "sub/c.xml", "sub/.hidden.xml", "sub/deeper/d.xml"]:
+        (tmp_path / f).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / f).write_text("<alto/>")
+
+    # The files of a directory come before those of its subdirectories
+    assert list(walk(str(tmp_path))) == [
+        str(tmp_path / "a.xml"),
+        str(tmp_path / "sub" / "c.xml"),
+        str(tmp_path / "sub" / "deeper" / "d.xml"),
+    ]
+
+    # A single file is passed through as is
+    assert list(walk(str(tmp_path / "sub" / "c.xml"))) == [str(tmp_path / "sub" / "c.xml")]
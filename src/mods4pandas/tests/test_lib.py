@@ -0,0 +1,33 @@
+import math
+
+from mods4pandas.lib import dicts_to_df
+
+
+def test_dicts_to_df():
+    data_list = [
+        {'id': 'a', 'set': {'x', 'y'}, 'count': 1},
+        {'id': 'b', 'text': 'foo'},
+    ]
+    df = dicts_to_df(data_list, index_column='id')
+
+    # Columns in order of first appearance
+    assert list(df.columns) == ['id', 'set', 'count', 'text']
+    assert list(df.index) == ['a', 'b']
+
+    assert df.loc['a', 'set'] == {'x', 'y'}
+    assert df.loc['b', 'text'] == 'foo'
+
+    # Missing values are None in object columns (e.g. sets), NaN in numeric columns
+    assert df.loc['b', 'set'] is None
+    assert math.isnan(df.loc['b', 'count'])
+
+
+def test_dicts_to_df_multiindex():
+    data_list = [
+        {'ppn': 'PPN1', 'ID': 'PHYS_0001', 'structMap-LOGICAL_TYPE_title_page': 1},
+        {'ppn': 'PPN1', 'ID': 'PHYS_0002'},
+    ]
+    df = dicts_to_df(data_list, index_column=('ppn', 'ID'))
+
+    assert df.index.names == ['ppn', 'ID']
+    assert list(df.index) == [('PPN1', 'PHYS_0001'), ('PPN1', 'PHYS_0002')]
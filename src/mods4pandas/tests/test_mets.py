@@ -5,9 +5,12 @@ from mods4pandas.mods4pandas import mets_to_dict
 from mods4pandas.lib import flatten
 
 
+# Parse like the tools do (see _parser there)
+_parser = ET.XMLParser(collect_ids=False)
+
 def dict_fromstring(x):
    """Helper function to parse a METS/MODS XML string to a flattened dict"""
-   return flatten(mets_to_dict(ET.fromstring(x)))
+   return flatten(mets_to_dict(ET.fromstring(x, _parser)))
    # XXX move to test lib
 
 def test_fileGrp():
@@ -6,9 +6,12 @@ from mods4pandas.mods4pandas import mods_to_dict
 from mods4pandas.lib import flatten
 
 
+# Parse like the tools do (see _parser there)
+_parser = ET.XMLParser(collect_ids=False)
+
 def dict_fromstring(x):
     """Helper function to parse a MODS XML string to a flattened dict"""
-    return flatten(mods_to_dict(ET.fromstring(x)))
+    return flatten(mods_to_dict(ET.fromstring(x, _parser)))
 
 def test_single_language_languageTerm():
     d = dict_fromstring("""
@@ -126,6 +129,27 @@ def test_originInfo_no_event_type():
     assert len(ws) == 1
     assert ws[0].message.args[0] == 'Filtered {http://www.loc.gov/mods/v3}originInfo element (has no eventType)'
 
+def test_originInfo_fixed_event_type():
+    with pytest.warns(UserWarning) as ws:
+        d = dict_fromstring("""
+        <mods:mods xmlns:mods="http://www.loc.gov/mods/v3">
+            <mods:originInfo>
+               <mods:publisher>Staatsbibliothek zu Berlin</mods:publisher>
+               <mods:edition>[Electronic ed.]</mods:edition>
+            </mods:originInfo>
+            <mods:originInfo>
+               <mods:dateIssued>1900</mods:dateIssued>
+            </mods:originInfo>
+        </mods:mods>
+        """)
+
+    assert d['originInfo-digitization0_publisher'] == 'Staatsbibliothek zu Berlin'
+    assert d['originInfo-publication0_dateIssued'] == '1900'
+
+    messages = [w.message.args[0] for w in ws]
+    assert 'Fixed eventType for electronic ed.' in messages
+    assert 'Fixed eventType for an issued origin' in messages
+
 def test_relatedItem():
     d = dict_fromstring("""
     <mods:mods xmlns:mods="http://www.loc.gov/mods/v3">
@@ -1,4 +1,3 @@
-import sys
 from pathlib import Path
 
 from lxml import etree as ET
@@ -9,13 +8,6 @@ from mods4pandas.mods4pandas import pages_to_dict
 TESTS_DATA_DIR = Path(__file__).parent / "data"
 
 
-def removeprefix(s, prefix):
-    if sys.version_info < (3,9):
-        return s[len(prefix):] if s.startswith(prefix) else s
-    else:
-        return s.removeprefix(prefix)
-
-
 def test_page_info():
     """Test creation of page_info"""
     mets = ET.parse(TESTS_DATA_DIR / "mets-mods" / "PPN821507109-1361-pages.xml")
@@ -27,13 +19,15 @@ def test_page_info():
 
     # Look closer at an interesting page
     from pprint import pprint; pprint(page_info[0])
-    page_info_page = next(p for p in page_info if p["ID"] == "PHYS_0005")
+    page_info_by_ID = {p["ID"]: p for p in page_info}
+    page_info_page = page_info_by_ID["PHYS_0005"]
 
     assert page_info_page["fileGrp_PRESENTATION_file_FLocat_href"] == "file:///goobi/tiff001/sbb/PPN821507109/00000005.tif"
 
     # This is a title page with an illustration, check that we correctly got this info from the
     # structMap.
-    struct_types = sorted(removeprefix(k, "structMap-LOGICAL_TYPE_") for k, v in page_info_page.items() if k.startswith("structMap-LOGICAL_TYPE_") and v == 1)
+    prefix = "structMap-LOGICAL_TYPE_"
+    struct_types = sorted(k[len(prefix):] for k, v in page_info_page.items() if k.startswith(prefix) and v == 1)
     assert struct_types == ["illustration", "monograph", "title_page"]
 
 
@@ -0,0 +1,68 @@
+import warnings
+from pathlib import Path
+
+import pytest
+
+from mods4pandas import alto4pandas, mods4pandas
+from mods4pandas.lib import capture_warnings
+
+
+TESTS_DATA_DIR = Path(__file__).parent / "data"
+
+
+@pytest.fixture
+def captured_warnings(monkeypatch):
+    """Install the warnings hook of the worker processes, restoring the warnings module afterwards"""
+    monkeypatch.setattr(warnings, "showwarning", warnings.showwarning)
+    monkeypatch.setattr(warnings, "filters", warnings.filters[:])
+    capture_warnings()
+
+
+def test_process_one_mets_warnings(captured_warnings, tmp_path):
+    mets_file = str(TESTS_DATA_DIR / "mets-mods" / "PPN3348760607-mehrere-shelfLocator.xml")
+    expected_warnings = [
+        'Forced single instance of {http://www.loc.gov/mods/v3}shelfLocator',
+        'Filtered {http://www.loc.gov/mods/v3}originInfo element (has no eventType)',
+        'Changed w3cdtf encoding to iso8601',
+    ]
+
+    d, page_info_doc, caught_warnings = mods4pandas._process_one(mets_file)
+    assert d['recordInfo_recordIdentifier'] == 'PPN3348760607'
+    assert page_info_doc == []
+    assert caught_warnings == expected_warnings
+
+    # The warnings of the first run must not carry over into the next one
+    _, _, caught_warnings = mods4pandas._process_one(mets_file)
+    assert caught_warnings == expected_warnings
+
+    # A file failing after some warnings were already emitted: The warnings are dropped with the result
+    broken_file = tmp_path / "broken.xml"
+    broken_file.write_text("""
+    <mets:mets xmlns:mets="http://www.loc.gov/METS/" xmlns:mods="http://www.loc.gov/mods/v3">
+      <mets:dmdSec><mets:mdWrap><mets:xmlData><mods:mods>
+        <mods:originInfo><mods:place><mods:placeTerm type="text">Berlin</mods:placeTerm></mods:place></mods:originInfo>
+        <mods:unknownTag/>
+      </mods:mods></mets:xmlData></mets:mdWrap></mets:dmdSec>
+    </mets:mets>
+    """)
+    assert mods4pandas._process_one(str(broken_file)) == (None, [], [])
+
+    _, _, caught_warnings = mods4pandas._process_one(mets_file)
+    assert caught_warnings == expected_warnings
+
+
+def test_process_one_alto_warnings(captured_warnings, tmp_path):
+    alto_file = str(TESTS_DATA_DIR / "alto" / "734008031" / "00000005.xml")
+
+    d, caught_warnings = alto4pandas._process_one(alto_file)
+    assert d['alto_file'] == alto_file
+    assert caught_warnings == []
+
+    # A warning left over from before is not reported for the next file, even if that fails
+    warnings.warn('Left over')
+    broken_file = tmp_path / "broken.xml"
+    broken_file.write_text('<alto xmlns="http://www.loc.gov/standards/alto/ns-v2#"><Layout>')
+    assert alto4pandas._process_one(str(broken_file)) == (None, [])
+
+    _, caught_warnings = alto4pandas._process_one(alto_file)
+    assert caught_warnings == []